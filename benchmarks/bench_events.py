@@ -0,0 +1,162 @@
+"""Event-loop throughput for receive_events: legacy if/elif path vs table dispatch.
+
+Replays a recorded session (one raw Realtime event per line, as written by
+EVENT_LOG=path) or, without --replay, a synthetic stream dominated by
+``response.audio.delta`` events. The legacy path mirrors the previous
+receive_events: json.loads, an if/elif chain, base64.b64decode and a hop
+through an asyncio.Queue before the samples reach the ring buffer.
+
+    python benchmarks/bench_events.py --events 20000
+    python benchmarks/bench_events.py --replay events.jsonl
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from websockets.exceptions import ConnectionClosedOK  # noqa: E402
+
+from main import AudioOut, AudioStreamer, RingBuffer, orjson  # noqa: E402
+
+SAMPLE_RATE = 24000
+DELTA_MS = 40
+
+
+class ReplaySocket:
+    """Hands out pre-recorded messages as fast as they are read."""
+
+    def __init__(self, messages):
+        self.messages = iter(messages)
+
+    async def recv(self):
+        try:
+            return next(self.messages)
+        except StopIteration:
+            raise ConnectionClosedOK(None, None)
+
+    async def send(self, message):
+        pass
+
+
+class SinkAudioOut(AudioOut):
+    """AudioOut without a device whose ring buffer is drained on every write."""
+
+    def __init__(self):
+        super().__init__(SAMPLE_RATE, 1, None)
+        self._scratch = np.empty(SAMPLE_RATE, dtype=np.int16)
+
+    def write_base64(self, encoded_audio):
+        super().write_base64(encoded_audio)
+        self.audio_buffer.read_into(self._scratch[:self.audio_buffer.available()])
+
+
+class BenchStreamer(AudioStreamer):
+    def __init__(self):
+        super().__init__("bench", None, None)
+        self.audio_out = SinkAudioOut()
+        self.event_log_path = None
+
+    def log(self, message, **fields):
+        pass
+
+
+async def legacy_receive(messages):
+    """The pre-dispatch-table receive loop, kept here as the baseline."""
+    ws = ReplaySocket(messages)
+    buffer = RingBuffer(SAMPLE_RATE * 30)
+    scratch = np.empty(SAMPLE_RATE, dtype=np.int16)
+    queue = asyncio.Queue()
+
+    async def playback():
+        while True:
+            chunk = await queue.get()
+            buffer.write(np.frombuffer(chunk, dtype=np.int16))
+            buffer.read_into(scratch[:buffer.available()])
+            queue.task_done()
+
+    player = asyncio.create_task(playback())
+    while True:
+        try:
+            message = await ws.recv()
+        except ConnectionClosedOK:
+            break
+        event = json.loads(message)
+        event_type = event["type"]
+        if event_type == "response.audio.delta":
+            await queue.put(base64.b64decode(event["delta"]))
+        elif event_type == "response.audio.done":
+            pass
+        elif event_type == "input_audio_buffer.speech_started":
+            pass
+        elif event_type == "input_audio_buffer.speech_stopped":
+            pass
+        elif event_type == "response.function_call_arguments.done":
+            pass
+        elif event_type == "response.done":
+            pass
+        elif event_type == "response.audio_transcript.done":
+            pass
+        elif event_type == "error":
+            pass
+    await queue.join()
+    player.cancel()
+
+
+async def table_receive(messages):
+    streamer = BenchStreamer()
+    await streamer.receive_events(ReplaySocket(messages))
+
+
+def synthetic_messages(count):
+    samples = np.zeros(SAMPLE_RATE * DELTA_MS // 1000, dtype=np.int16)
+    delta = json.dumps({
+        "type": "response.audio.delta",
+        "delta": base64.b64encode(samples.tobytes()).decode('utf-8'),
+    })
+    transcript = json.dumps({"type": "response.audio_transcript.delta", "delta": "Hi"})
+    messages = []
+    for i in range(count):
+        messages.append(transcript if i % 10 == 9 else delta)
+    return messages
+
+
+def run(label, receive, messages, rounds):
+    best = None
+    for _ in range(rounds):
+        started = time.perf_counter()
+        asyncio.run(receive(messages))
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"{label:>8} {len(messages) / best:>14,.0f} {best * 1000:>10.1f}")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--events', type=int, default=20000)
+    parser.add_argument('--replay', help="JSONL file of raw Realtime events (EVENT_LOG output)")
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.replay:
+        with open(args.replay) as f:
+            messages = [line for line in f if line.strip()]
+    else:
+        messages = synthetic_messages(args.events)
+
+    print(f"{len(messages)} events, JSON parser: {'orjson' if orjson is not None else 'json'}")
+    print(f"{'path':>8} {'events/sec':>14} {'best ms':>10}")
+    legacy = run("legacy", legacy_receive, messages, args.rounds)
+    table = run("table", table_receive, messages, args.rounds)
+    print(f"speedup: {legacy / table:.2f}x")
+
+
+if __name__ == '__main__':
+    main()
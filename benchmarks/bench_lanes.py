@@ -0,0 +1,160 @@
+"""Load test for LaneManager: per-lane audio delivery latency as lanes are added.
+
+Each lane talks to an in-process fake Realtime socket that streams
+``response.audio.delta`` events on a fixed schedule while the lane pushes
+20 ms microphone frames upstream. Latency is measured from the moment a delta
+is due until its samples land in the lane's playback ring buffer.
+
+    python benchmarks/bench_lanes.py --lanes 1 2 4 8 --seconds 10
+"""
+import argparse
+import asyncio
+import base64
+import collections
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from websockets.exceptions import ConnectionClosedOK  # noqa: E402
+
+from main import AudioOut, AudioStreamer, LaneManager  # noqa: E402
+
+SAMPLE_RATE = 24000
+DELTA_MS = 40
+MIC_FRAME_MS = 20
+
+
+class FakeRealtimeSocket:
+    """Serves session.created, then audio deltas every DELTA_MS until closed."""
+
+    def __init__(self, due_times):
+        self.due_times = due_times
+        self.sent = 0
+        self.closed = False
+        self._started = False
+        self._next_due = None
+        samples = np.zeros(SAMPLE_RATE * DELTA_MS // 1000, dtype=np.int16)
+        self._delta = json.dumps({
+            "type": "response.audio.delta",
+            "delta": base64.b64encode(samples.tobytes()).decode('utf-8'),
+        })
+
+    async def recv(self):
+        if self.closed:
+            raise ConnectionClosedOK(None, None)
+        if not self._started:
+            self._started = True
+            self._next_due = time.perf_counter()
+            return json.dumps({"type": "session.created"})
+        delay = self._next_due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self.due_times.append(self._next_due)
+        self._next_due += DELTA_MS / 1000
+        return self._delta
+
+    async def send(self, message):
+        self.sent += 1
+
+    async def close(self):
+        self.closed = True
+
+
+class NullAudioOut(AudioOut):
+    """AudioOut without a device: drains the ring buffer at real-time pace."""
+
+    def __init__(self, due_times, latencies):
+        super().__init__(SAMPLE_RATE, 1, None)
+        self.due_times = due_times
+        self.latencies = latencies
+        self._drain_task = None
+
+    async def start(self):
+        self._drain_task = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        out = np.empty(SAMPLE_RATE * 10 // 1000, dtype=np.int16)
+        while True:
+            await asyncio.sleep(0.01)
+            self.audio_buffer.read_into(out)
+
+    def write_base64(self, encoded_audio):
+        super().write_base64(encoded_audio)
+        if self.due_times:
+            self.latencies.append(time.perf_counter() - self.due_times.popleft())
+
+    async def stop(self):
+        if self._drain_task:
+            self._drain_task.cancel()
+
+
+class BenchStreamer(AudioStreamer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.due_times = collections.deque()
+        self.latencies = []
+        self.audio_out = NullAudioOut(self.due_times, self.latencies)
+
+    def log(self, message, **fields):
+        pass
+
+    async def start(self):
+        ws = FakeRealtimeSocket(self.due_times)
+        await self.configure_session(ws)
+        await self.startInteraction(ws)
+
+    async def send_audio(self, ws):
+        frame = np.zeros(SAMPLE_RATE * MIC_FRAME_MS // 1000, dtype=np.int16).tobytes()
+        while self.should_record:
+            await ws.send(json.dumps({
+                "type": "input_audio_buffer.append",
+                "audio": base64.b64encode(frame).decode('utf-8'),
+            }))
+            await asyncio.sleep(MIC_FRAME_MS / 1000)
+
+
+async def run_lanes(lane_count, seconds):
+    manager = LaneManager("bench", streamer_class=BenchStreamer)
+    for i in range(lane_count):
+        manager.add_lane(f"lane-{i + 1}", None, None)
+    for lane_id in manager.lanes:
+        manager.start_lane(lane_id)
+    await asyncio.sleep(seconds)
+    for lane_id in manager.lanes:
+        await manager.stop_lane(lane_id)
+    return {lane_id: streamer.latencies for lane_id, streamer in manager.lanes.items()}
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lanes', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    print(f"{'lanes':>5} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'worst lane p99':>15}")
+    for lane_count in args.lanes:
+        results = asyncio.run(run_lanes(lane_count, args.seconds))
+        all_latencies = [v for values in results.values() for v in values]
+        worst_p99 = max(percentile(values, 99) for values in results.values() if values)
+        print(
+            f"{lane_count:>5} "
+            f"{statistics.median(all_latencies) * 1000:>8.2f} "
+            f"{percentile(all_latencies, 99) * 1000:>8.2f} "
+            f"{max(all_latencies) * 1000:>8.2f} "
+            f"{worst_p99 * 1000:>15.2f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
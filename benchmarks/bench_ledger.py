@@ -0,0 +1,126 @@
+"""Sustained ledger writes at multi-lane rates: background writer vs inline SQLite commits.
+
+Every simulated lane records a transcript line per turn, a quote every few
+turns and an order every few quotes, all from one event loop, the way
+AudioStreamer does. Reported per lane count:
+
+- loop stall: time the event loop spends inside each record call (p50/p99/max),
+- rows/sec actually committed and how many rows were dropped,
+- commit lag: time from record() to the commit that contains it (writer only).
+
+The inline baseline commits each row on the event loop, as a naive ledger would.
+
+    python benchmarks/bench_ledger.py --lanes 4 16 64 --seconds 5 --rate 50
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import LEDGER_INSERTS, LEDGER_SCHEMA, Ledger  # noqa: E402
+
+QUOTE = {
+    "lines": [{"name": "Basic Burrito", "quantity": 2, "unit_price": 3.39, "line_total": 6.78, "size": "smothered"}],
+    "total": 6.78,
+    "unresolved": [],
+}
+
+
+class InlineLedger:
+    """Baseline: one INSERT and COMMIT per row, on the caller's thread."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(LEDGER_SCHEMA)
+        self.written = 0
+        self.dropped = 0
+
+    def _insert(self, table, values):
+        with self.db:
+            self.db.execute(LEDGER_INSERTS[table], values)
+        self.written += 1
+
+    def record_order(self, lane, order):
+        self._insert("orders", (order["order_id"], lane, order["placed_at"], order["payment_method"], order["total"], json.dumps(order["lines"])))
+
+    def record_quote(self, lane, quote):
+        self._insert("quotes", (lane, "now", quote["total"], json.dumps(quote["lines"]), json.dumps(quote["unresolved"])))
+
+    def record_transcript(self, lane, speaker, text):
+        self._insert("transcripts", (lane, "now", speaker, text))
+
+    def close(self):
+        self.db.close()
+
+
+async def lane(ledger, lane_id, rate, seconds, stalls):
+    turn = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        turn += 1
+        started = time.perf_counter()
+        ledger.record_transcript(lane_id, "Gus", "Welcome to Los Pollos Hermanos. What can I get started for you today?")
+        if turn % 5 == 0:
+            ledger.record_quote(lane_id, QUOTE)
+        if turn % 25 == 0:
+            ledger.record_order(lane_id, {
+                "order_id": f"{lane_id}-{turn}", "placed_at": "now", "payment_method": "Cash",
+                "total": QUOTE["total"], "lines": QUOTE["lines"],
+            })
+        stalls.append(time.perf_counter() - started)
+        await asyncio.sleep(1 / rate)
+
+
+async def run(ledger, lane_count, rate, seconds):
+    stalls = []
+    await asyncio.gather(*(lane(ledger, f"lane-{i + 1}", rate, seconds, stalls) for i in range(lane_count)))
+    return stalls
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lanes', type=int, nargs='+', default=[4, 16, 64])
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--rate', type=float, default=50.0, help="turns per second per lane")
+    args = parser.parse_args()
+
+    print(f"{'mode':>7} {'lanes':>5} {'stall p50 us':>13} {'p99 us':>8} {'max ms':>8} {'rows/s':>9} {'dropped':>8} {'commit lag':>22}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for lane_count in args.lanes:
+            for mode in ("inline", "writer"):
+                path = os.path.join(workdir, f"{mode}-{lane_count}.db")
+                ledger = InlineLedger(path) if mode == "inline" else Ledger(path)
+                started = time.perf_counter()
+                stalls = asyncio.run(run(ledger, lane_count, args.rate, args.seconds))
+                ledger.close()
+                elapsed = time.perf_counter() - started
+                lag = ""
+                if mode == "writer":
+                    mean = ledger.commit_lag.total / max(ledger.commit_lag.count, 1)
+                    lag = f"avg {mean * 1000:.1f} / max {ledger.commit_lag.max * 1000:.1f} ms"
+                print(
+                    f"{mode:>7} {lane_count:>5} "
+                    f"{percentile(stalls, 50) * 1e6:>13.1f} "
+                    f"{percentile(stalls, 99) * 1e6:>8.1f} "
+                    f"{max(stalls) * 1000:>8.2f} "
+                    f"{ledger.written / elapsed:>9.0f} "
+                    f"{ledger.dropped:>8} "
+                    f"{lag:>22}"
+                )
+
+
+if __name__ == '__main__':
+    main()
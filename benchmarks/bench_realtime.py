@@ -0,0 +1,165 @@
+"""End-to-end lane benchmark against the offline Realtime stand-in.
+
+Each lane is a regular AudioStreamer whose microphone is a generated WAV of
+scripted customer turns (WavAudioIn) and whose speaker is a WAV file
+(WavAudioOut); the server is benchmarks/fake_realtime.py in a subprocess so
+its CPU is not charged to the lanes. Reported per lane count:
+
+- end of speech to first audio: from the moment a customer turn ends in the
+  input file until reply audio starts playing out (includes the server VAD
+  silence window, silence_duration_ms),
+- playback underruns: times the speaker ran dry in the middle of a reply,
+- CPU: process CPU time per lane as a percentage of one core.
+
+    python benchmarks/bench_realtime.py --lanes 1 2 4 --turns 3
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import wave
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from main import AudioStreamer, LaneManager, WavAudioOut  # noqa: E402
+
+SAMPLE_RATE = 24000
+
+
+def write_customer_wav(path, turns, speech_s, gap_s):
+    """Writes alternating speech-like noise and silence; returns the speech end offsets in seconds."""
+    rng = np.random.default_rng(7)
+    pieces = []
+    speech_ends = []
+    offset = 0.0
+    for _ in range(turns):
+        pieces.append(np.zeros(int(SAMPLE_RATE * 0.3), dtype=np.int16))
+        envelope = np.hanning(int(SAMPLE_RATE * speech_s)) ** 0.2
+        pieces.append((rng.standard_normal(len(envelope)) * envelope * 6000).astype(np.int16))
+        offset += 0.3 + speech_s
+        speech_ends.append(offset)
+        pieces.append(np.zeros(int(SAMPLE_RATE * gap_s), dtype=np.int16))
+        offset += gap_s
+    with wave.open(path, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(np.concatenate(pieces).tobytes())
+    return speech_ends, offset
+
+
+class BenchStreamer(AudioStreamer):
+    """AudioStreamer on WAV backends that remembers when its capture stream started."""
+
+    input_path = None
+    output_dir = None
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.input_wav = self.input_path
+        self.audio_in = None
+
+    def create_audio_out(self):
+        return WavAudioOut(os.path.join(self.output_dir, f"{self.lane_id}.wav"), self.sample_rate, self.channels)
+
+    def create_audio_in(self, callback, blocksize):
+        self.audio_in = super().create_audio_in(callback, blocksize)
+        return self.audio_in
+
+    def log(self, message, **fields):
+        pass
+
+
+def start_server(args):
+    command = [
+        sys.executable, os.path.join(BENCH_DIR, 'fake_realtime.py'), '--port', '0',
+        '--first-audio-ms', str(args.first_audio_ms), '--tool-every', str(args.tool_every),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        raise RuntimeError("Fake Realtime server did not start.")
+    return server, line.strip().rsplit(' ', 1)[-1]
+
+
+def first_audio_latencies(speech_ends, started_at, playback_starts):
+    """Pairs each end of speech with the first playback start after it."""
+    latencies = []
+    for offset in speech_ends:
+        ended_at = started_at + offset
+        following = [t for t in playback_starts if t >= ended_at]
+        if following:
+            latencies.append(following[0] - ended_at)
+    return latencies
+
+
+async def run_lanes(lane_count, duration):
+    manager = LaneManager("bench", streamer_class=BenchStreamer)
+    for i in range(lane_count):
+        manager.add_lane(f"lane-{i + 1}", None, None)
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    for lane_id in manager.lanes:
+        manager.start_lane(lane_id)
+    await asyncio.sleep(duration)
+    for lane_id in manager.lanes:
+        await manager.stop_lane(lane_id)
+    cpu = (time.process_time() - cpu_started) / (time.perf_counter() - wall_started)
+    return manager, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--lanes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--turns', type=int, default=3)
+    parser.add_argument('--speech', type=float, default=1.2, help="seconds of speech per turn")
+    parser.add_argument('--gap', type=float, default=4.0, help="seconds of silence after each turn")
+    parser.add_argument('--first-audio-ms', type=int, default=0, help="simulated model latency")
+    parser.add_argument('--tool-every', type=int, default=0, help="answer every Nth turn with a function call")
+    args = parser.parse_args()
+
+    server, url = start_server(args)
+    os.environ["WS_URL"] = url
+    os.environ.setdefault("MODEL", "fake")
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            BenchStreamer.input_path = os.path.join(workdir, 'customer.wav')
+            BenchStreamer.output_dir = workdir
+            speech_ends, duration = write_customer_wav(BenchStreamer.input_path, args.turns, args.speech, args.gap)
+
+            print(f"{'lanes':>5} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'replies':>8} {'underruns':>10} {'CPU %/lane':>11}")
+            for lane_count in args.lanes:
+                manager, cpu = asyncio.run(run_lanes(lane_count, duration + 0.5))
+                latencies, underruns = [], 0
+                for lane_id, streamer in manager.lanes.items():
+                    if lane_id in manager.errors:
+                        print(f"[{lane_id}] failed: {manager.errors[lane_id]}")
+                    if streamer.audio_in is not None:
+                        latencies += first_audio_latencies(speech_ends, streamer.audio_in.started_at, streamer.audio_out.playback_starts)
+                    underruns += streamer.audio_out.audio_buffer.underruns
+                if not latencies:
+                    print(f"{lane_count:>5} no replies received")
+                    continue
+                ordered = sorted(latencies)
+                print(
+                    f"{lane_count:>5} "
+                    f"{statistics.median(ordered) * 1000:>8.0f} "
+                    f"{ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000:>8.0f} "
+                    f"{ordered[-1] * 1000:>8.0f} "
+                    f"{len(latencies):>8} "
+                    f"{underruns:>10} "
+                    f"{cpu * 100 / lane_count:>11.1f}"
+                )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
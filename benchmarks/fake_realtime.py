@@ -0,0 +1,214 @@
+"""Offline stand-in for the OpenAI Realtime API.
+
+Speaks the subset of the event protocol main.py relies on: session.created /
+session.updated, server VAD (input_audio_buffer.speech_started / stopped /
+committed), input audio transcription when the session asks for it, spoken responses as response.audio.delta + transcript events,
+function calls answered through conversation.item.create, and
+response.cancel. Replies are a short tone rather than speech. --drop-after
+cuts every connection after a while to exercise reconnects.
+
+    python benchmarks/fake_realtime.py --port 8765
+    WS_URL=ws://127.0.0.1:8765 INPUT_WAV=customer.wav OUTPUT_WAV=reply.wav python main.py
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+
+import numpy as np
+import websockets
+from websockets.exceptions import ConnectionClosed
+
+SAMPLE_RATE = 24000
+SAMPLE_ORDER = {"products": [{"name": "Basic Burrito", "quantity": 2, "size": "smothered"}]}
+SAMPLE_UTTERANCE = "Two smothered basic burritos, please."
+
+
+class FakeRealtimeSession:
+    """One client connection: a tiny energy VAD and scripted responses."""
+
+    ids = itertools.count(1)
+
+    def __init__(self, ws, options):
+        self.ws = ws
+        self.options = options
+        self.turn_detection = {"type": "server_vad", "threshold": 0.5, "silence_duration_ms": 500}
+        self.input_transcription = None
+        self.speaking = False
+        self.silent_ms = 0.0
+        self.turns = 0
+        self.tool_answered = False
+        self.response_task = None
+
+    def next_id(self, prefix):
+        return f"{prefix}_{next(self.ids)}"
+
+    async def send(self, event):
+        event.setdefault("event_id", self.next_id("event"))
+        await self.ws.send(json.dumps(event))
+
+    async def run(self):
+        if self.options.drop_after:
+            # Simulates a network failure: the socket goes away without a goodbye.
+            asyncio.get_running_loop().call_later(self.options.drop_after, self.ws.transport.abort)
+        await self.send({"type": "session.created", "session": {"id": self.next_id("sess"), "object": "realtime.session"}})
+        try:
+            async for message in self.ws:
+                event = json.loads(message)
+                handler = getattr(self, "on_" + event["type"].replace(".", "_"), None)
+                if handler is not None:
+                    await handler(event)
+        except ConnectionClosed:
+            pass
+        finally:
+            if self.response_task is not None:
+                self.response_task.cancel()
+
+    async def on_session_update(self, event):
+        if "turn_detection" in event.get("session", {}):
+            self.turn_detection = event["session"]["turn_detection"]
+        if "input_audio_transcription" in event.get("session", {}):
+            self.input_transcription = event["session"]["input_audio_transcription"]
+        await self.send({"type": "session.updated", "session": event.get("session", {})})
+
+    async def on_input_audio_buffer_append(self, event):
+        if self.turn_detection is None:
+            return
+        samples = np.frombuffer(base64.b64decode(event["audio"]), dtype=np.int16)
+        if not len(samples):
+            return
+        rms = np.sqrt(np.mean(samples.astype(np.float32) ** 2)) / 32768
+        level_db = 20 * np.log10(max(rms, 1e-10))
+        duration_ms = len(samples) * 1000 / SAMPLE_RATE
+        if level_db > self.options.vad_threshold_db:
+            self.silent_ms = 0.0
+            if not self.speaking:
+                self.speaking = True
+                await self.send({"type": "input_audio_buffer.speech_started", "item_id": self.next_id("item")})
+        elif self.speaking:
+            self.silent_ms += duration_ms
+            if self.silent_ms >= self.turn_detection.get("silence_duration_ms", 500):
+                self.speaking = False
+                item_id = self.next_id("item")
+                await self.send({"type": "input_audio_buffer.speech_stopped", "item_id": item_id})
+                await self.commit(item_id)
+                self.turns += 1
+                self.tool_answered = False
+                if self.turn_detection.get("create_response", True):
+                    self.start_response()
+
+    async def on_input_audio_buffer_commit(self, event):
+        self.turns += 1
+        self.tool_answered = False
+        await self.commit(self.next_id("item"))
+
+    async def commit(self, item_id):
+        await self.send({"type": "input_audio_buffer.committed", "item_id": item_id})
+        if self.input_transcription:
+            await self.send({"type": "conversation.item.input_audio_transcription.completed",
+                             "item_id": item_id, "content_index": 0, "transcript": SAMPLE_UTTERANCE})
+
+    async def on_conversation_item_create(self, event):
+        if event.get("item", {}).get("type") == "function_call_output":
+            self.tool_answered = True
+
+    async def on_response_create(self, event):
+        self.start_response()
+
+    async def on_response_cancel(self, event):
+        if self.response_task is not None and not self.response_task.done():
+            self.response_task.cancel()
+
+    def start_response(self):
+        if self.response_task is not None and not self.response_task.done():
+            return
+        self.response_task = asyncio.create_task(self.respond())
+
+    def wants_tool_call(self):
+        every = self.options.tool_every
+        return bool(every) and self.turns % every == 0 and not self.tool_answered
+
+    async def respond(self):
+        response_id = self.next_id("resp")
+        status = "completed"
+        try:
+            await self.send({"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
+            if self.options.first_audio_ms:
+                await asyncio.sleep(self.options.first_audio_ms / 1000)
+            if self.wants_tool_call():
+                await self.send({
+                    "type": "response.function_call_arguments.done",
+                    "response_id": response_id,
+                    "item_id": self.next_id("item"),
+                    "output_index": 0,
+                    "call_id": self.next_id("call"),
+                    "name": "calculate_product_sum",
+                    "arguments": json.dumps(SAMPLE_ORDER),
+                })
+            else:
+                await self.stream_audio(response_id)
+        except asyncio.CancelledError:
+            status = "cancelled"
+        except ConnectionClosed:
+            return
+        try:
+            await self.send({"type": "response.done", "response": {"id": response_id, "status": status}})
+        except ConnectionClosed:
+            pass
+
+    async def stream_audio(self, response_id):
+        chunk_samples = SAMPLE_RATE * self.options.chunk_ms // 1000
+        total_chunks = max(1, self.options.response_ms // self.options.chunk_ms)
+        t = np.arange(chunk_samples) / SAMPLE_RATE
+        tone = (np.sin(2 * np.pi * 440 * t) * 8000).astype(np.int16)
+        delta = base64.b64encode(tone.tobytes()).decode('utf-8')
+        for _ in range(total_chunks):
+            await self.send({"type": "response.audio.delta", "response_id": response_id, "delta": delta})
+            # The real API streams audio faster than it plays; pace by realtime_factor.
+            await asyncio.sleep(self.options.chunk_ms / 1000 / self.options.realtime_factor)
+        await self.send({"type": "response.audio.done", "response_id": response_id})
+        await self.send({"type": "response.audio_transcript.done", "response_id": response_id,
+                         "transcript": "Welcome to Los Pollos Hermanos."})
+
+
+async def serve(options, ready=None):
+    """Serves until cancelled; ready(port) is called once the socket is bound."""
+    async def handler(ws):
+        await FakeRealtimeSession(ws, options).run()
+
+    async with websockets.serve(handler, options.host, options.port) as server:
+        port = next(iter(server.sockets)).getsockname()[1]
+        if ready is not None:
+            ready(port)
+        await asyncio.Future()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765, help="0 picks a free port")
+    parser.add_argument('--vad-threshold-db', type=float, default=-40.0)
+    parser.add_argument('--first-audio-ms', type=int, default=0, help="simulated model latency")
+    parser.add_argument('--response-ms', type=int, default=1500, help="length of each spoken reply")
+    parser.add_argument('--chunk-ms', type=int, default=100, help="audio per response.audio.delta")
+    parser.add_argument('--realtime-factor', type=float, default=2.0)
+    parser.add_argument('--tool-every', type=int, default=0, help="answer every Nth turn with a function call")
+    parser.add_argument('--drop-after', type=float, default=0, help="abort each connection after this many seconds")
+    return parser.parse_args(argv)
+
+
+def main():
+    options = parse_args()
+
+    def ready(port):
+        print(f"Fake Realtime API listening on ws://{options.host}:{port}", flush=True)
+
+    try:
+        asyncio.run(serve(options, ready))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import asyncio
+import base64
+import gzip
+import os
+import sqlite3
+import sys
+import wave
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import BrowserSession, Ledger  # noqa: E402
+
+ORDER = {
+    "order_id": "a1b2c3d4",
+    "placed_at": "2026-10-16T12:00:00",
+    "payment_method": "Cash",
+    "total": 6.78,
+    "lines": [{"name": "Basic Burrito", "quantity": 2, "unit_price": 3.39, "line_total": 6.78, "size": "smothered"}],
+}
+
+
+def read_archive(path):
+    with gzip.open(path, "rb") as f, wave.open(f, "rb") as w:
+        return w.getnchannels(), w.getsampwidth(), w.getframerate(), w.readframes(w.getnframes())
+
+
+def test_archives_multi_chunk_order_audio(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.db"), audio_dir=str(tmp_path / "audio"))
+    customer = [bytes([i]) * 960 for i in range(5)]
+    assistant = [base64.b64encode(bytes([i + 10]) * 480).decode() for i in range(3)]
+    ledger.record_order("lane-1", ORDER)
+    ledger.archive_audio(ORDER["order_id"], customer, assistant)
+    ledger.close()
+
+    assert ledger.errors == 0
+    db = sqlite3.connect(str(tmp_path / "ledger.db"))
+    customer_path, assistant_path = db.execute(
+        "SELECT customer_audio, assistant_audio FROM orders WHERE order_id = ?", (ORDER["order_id"],)
+    ).fetchone()
+    assert read_archive(customer_path) == (1, 2, 24000, b"".join(customer))
+    assert read_archive(assistant_path) == (1, 2, 24000, b"".join(base64.b64decode(chunk) for chunk in assistant))
+
+
+def test_bad_row_does_not_lose_the_batch_or_block_close(tmp_path):
+    ledger = Ledger(str(tmp_path / "ledger.db"))
+    for i in range(10):
+        ledger.record_transcript("lane-1", "Gus", f"line {i}")
+    ledger._put("transcripts", ("lane-1", "now", "Gus", object()))
+    ledger.close()
+
+    assert not ledger._thread.is_alive()
+    assert ledger.errors == 1
+    db = sqlite3.connect(str(tmp_path / "ledger.db"))
+    assert db.execute("SELECT COUNT(*) FROM transcripts").fetchone() == (10,)
+
+
+def test_records_both_sides_of_the_transcript(tmp_path):
+    session = BrowserSession("test-key", "lane-1")
+    session.ledger = Ledger(str(tmp_path / "ledger.db"))
+
+    async def run():
+        await session.on_input_transcript(None, {"transcript": "Two smothered basic burritos, please."})
+        await session.on_transcript(None, {"transcript": "Two smothered basic burritos. Anything else?"})
+
+    try:
+        asyncio.run(run())
+    finally:
+        session.ledger.close()
+        asyncio.run(session.close())
+
+    db = sqlite3.connect(str(tmp_path / "ledger.db"))
+    assert db.execute("SELECT lane, speaker FROM transcripts ORDER BY id").fetchall() == [
+        ("lane-1", "Customer"), ("lane-1", "Gus")
+    ]
@@ -0,0 +1,103 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import MenuCatalog  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    return MenuCatalog.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'menu.json'))
+
+
+def reasons(quote):
+    return [entry["reason"] for entry in quote["unresolved"]]
+
+
+def test_prices_sized_item_with_add_ons(catalog):
+    quote = catalog.price_order([
+        {"name": "basic burritos", "quantity": 2, "size": "Smothered", "modifiers": ["sour cream", "lettuce and tomato"]}
+    ])
+    assert quote["unresolved"] == []
+    assert quote["lines"] == [{
+        "name": "Basic Burrito",
+        "quantity": 2,
+        "unit_price": 4.13,
+        "line_total": 8.26,
+        "size": "smothered",
+        "modifiers": ["Sour Cream", "Lettuce & Tomato"]
+    }]
+    assert quote["total"] == 8.26
+
+
+def test_single_size_item_needs_no_size(catalog):
+    quote = catalog.price_order([{"name": "Churros", "quantity": 3}])
+    assert quote["unresolved"] == []
+    assert quote["total"] == 4.17
+    assert "size" not in quote["lines"][0]
+
+
+def test_omitted_quantity_is_one(catalog):
+    quote = catalog.price_order([{"name": "Churros"}])
+    assert quote["lines"][0]["quantity"] == 1
+
+
+def test_whole_float_quantity_is_accepted(catalog):
+    quote = catalog.price_order([{"name": "Churros", "quantity": 2.0}])
+    assert quote["lines"][0]["quantity"] == 2
+    assert quote["total"] == 2.78
+
+
+@pytest.mark.parametrize("quantity", [0, -3, 1.5, "2", True])
+def test_rejects_quantity_that_is_not_a_positive_integer(catalog, quantity):
+    quote = catalog.price_order([{"name": "Cheeseburger", "quantity": quantity, "size": "combo"}])
+    assert quote["lines"] == []
+    assert quote["total"] == 0
+    assert reasons(quote) == ["quantity must be a whole number of at least 1"]
+
+
+def test_multi_size_item_without_size_is_unresolved(catalog):
+    quote = catalog.price_order([{"name": "Coke", "quantity": 1}])
+    assert quote["lines"] == []
+    assert reasons(quote) == ["size must be one of: small, medium, large"]
+
+
+@pytest.mark.parametrize("size", ["s", "sm", "hand"])
+def test_size_prefix_does_not_match(catalog, size):
+    quote = catalog.price_order([{"name": "Basic Burrito", "quantity": 1, "size": size}])
+    assert quote["lines"] == []
+    assert quote["unresolved"][0]["reason"].startswith("size must be one of")
+
+
+@pytest.mark.parametrize("size", ["2 piece", "2 Pieces", "handheld"])
+def test_size_ignores_case_spacing_and_plurals(catalog, size):
+    name = "Basic Burrito" if size == "handheld" else "Taco Platter"
+    quote = catalog.price_order([{"name": name, "quantity": 1, "size": size}])
+    assert quote["unresolved"] == []
+
+
+def test_add_on_from_another_category_is_unresolved(catalog):
+    quote = catalog.price_order([{"name": "Churros", "quantity": 1, "modifiers": ["Guacamole"]}])
+    assert reasons(quote) == ["not an add-on for Churros"]
+
+
+def test_add_on_from_items_category_is_priced(catalog):
+    quote = catalog.price_order([{"name": "Taco Platter", "quantity": 1, "size": "2 pieces", "modifiers": ["Guacamole"]}])
+    assert quote["unresolved"] == []
+    assert quote["total"] == 5.39
+
+
+def test_unknown_item_is_unresolved(catalog):
+    quote = catalog.price_order([{"name": "Blue Sky Special", "quantity": 1}])
+    assert quote["unresolved"] == [{"name": "Blue Sky Special", "reason": "not on the menu"}]
+
+
+def test_total_sums_lines_in_cents(catalog):
+    quote = catalog.price_order([
+        {"name": "Soda", "quantity": 3, "size": "medium"},
+        {"name": "Cheese Burger", "quantity": 1, "size": "a la carte"}
+    ])
+    assert quote["total"] == 9.06
@@ -0,0 +1,39 @@
+import asyncio
+import base64
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from main import BrowserSession, MetricsRegistry  # noqa: E402
+
+
+def test_audio_done_between_turn_end_and_first_delta():
+    """A cancelled reply finishing after speech_stopped must not break the next delta."""
+    session = BrowserSession("test-key", "turn-order")
+    delta = {"delta": base64.b64encode(b"\0\0" * 240).decode()}
+
+    async def run():
+        await session.on_speech_stopped(None, {})
+        await session.on_audio_done(None, {})
+        session.on_audio_delta(delta)
+        await session.on_speech_stopped(None, {})
+        session.on_audio_delta(delta)
+
+    try:
+        asyncio.run(run())
+        assert session.metrics.histograms[("first_audio_seconds", ())].count == 1
+    finally:
+        asyncio.run(session.close())
+
+
+def test_render_escapes_label_values():
+    registry = MetricsRegistry()
+    metrics = registry.register('a"b\nc\\d')
+    metrics.inc("reconnects")
+    metrics.observe("tool_call_seconds", 0.02, tool="calculate_product_sum")
+    text = registry.render()
+    assert 'drive_thru_reconnects_total{session="a\\"b\\nc\\\\d"} 1' in text
+    # Every sample stays on one line: name{labels} value.
+    for line in text.splitlines():
+        assert line.startswith("# TYPE ") or line.startswith("drive_thru_")